@@ -0,0 +1,136 @@
+from operator import eq, itemgetter
+from typing import Optional
+
+import numpy as np
+
+# teto de grupos por período no modo agrupado (o join precisa dos dois lados completos)
+MAX_GROUPS = 100_000
+
+
+def _hashes(keys: list) -> np.ndarray:
+    return np.fromiter(map(hash, keys), dtype=np.int64, count=len(keys))
+
+
+def _all_distinct(codes: np.ndarray) -> bool:
+    ordered = np.sort(codes)
+    return bool(np.all(ordered[1:] != ordered[:-1]))
+
+
+def _join(cur_keys: list, prev_keys: list):
+    # caminho rápido: hash das chaves em C; como o group by garante chave única
+    # por período, colisão aparece como hash repetido ou par casado diferente
+    cur_codes, prev_codes = _hashes(cur_keys), _hashes(prev_keys)
+    if _all_distinct(cur_codes) and _all_distinct(prev_codes):
+        _, ci, pi = np.intersect1d(
+            cur_codes, prev_codes, assume_unique=True, return_indices=True
+        )
+        if all(map(eq, map(cur_keys.__getitem__, ci), map(prev_keys.__getitem__, pi))):
+            return ci, pi
+
+    # fallback exato: códigos densos via dict
+    all_keys = cur_keys + prev_keys
+    index = {k: i for i, k in enumerate(dict.fromkeys(all_keys))}
+    codes = np.fromiter(map(index.__getitem__, all_keys), dtype=np.int64, count=len(all_keys))
+    cur_codes, prev_codes = codes[: len(cur_keys)], codes[len(cur_keys) :]
+    _, ci, pi = np.intersect1d(cur_codes, prev_codes, return_indices=True)
+    return ci, pi
+
+
+def _metric_values(rows: list, metric: str) -> np.ndarray:
+    return np.array(list(map(itemgetter(metric), rows)), dtype=np.float64)
+
+
+def extract_columns(rows: list, keys: list[str], metric: str):
+    # extração linha a linha: as linhas chegam como dicts (psycopg/DuckDB), então
+    # chaves e valores são copiados um a um em Python antes da parte vetorizada;
+    # esse passo (e o hash das chaves em _join) não é colunar
+    return list(map(itemgetter(*keys), rows)), _metric_values(rows, metric)
+
+
+def deltas(cur_v: np.ndarray, prev_v: np.ndarray):
+    # delta_abs, delta_pct e trend em float64; NaN = valor ausente
+    with np.errstate(divide="ignore", invalid="ignore"):
+        delta_abs = cur_v - prev_v
+        delta_pct = np.where(prev_v != 0, delta_abs / prev_v, np.nan)
+    trend = np.select(
+        [np.isnan(delta_abs), delta_abs > 0, delta_abs < 0],
+        ["indefinido", "aclive", "declive"],
+        "estavel",
+    )
+    return delta_abs, delta_pct, trend
+
+
+def _as_value(x: float) -> Optional[float]:
+    return None if np.isnan(x) else float(x)
+
+
+def _movers_order(values: np.ndarray) -> np.ndarray:
+    # maiores variações absolutas primeiro, NaN no fim
+    return np.argsort(-np.nan_to_num(np.abs(values), nan=-1.0), kind="stable")
+
+
+def compare_values(cur_value, prev_value) -> dict:
+    # modo sem group_by: mesma aritmética e mesmos tipos (float) do modo agrupado
+    cur_v = np.array([cur_value], dtype=np.float64)
+    prev_v = np.array([prev_value], dtype=np.float64)
+    delta_abs, delta_pct, trend = deltas(cur_v, prev_v)
+    return {
+        "current": _as_value(cur_v[0]),
+        "previous": _as_value(prev_v[0]),
+        "delta_abs": _as_value(delta_abs[0]),
+        "delta_pct": _as_value(delta_pct[0]),
+        "trend": str(trend[0]),
+    }
+
+
+def compare_grouped(
+    cur_rows: list, prev_rows: list, keys: list[str], metric: str, limit: int = 200
+) -> dict:
+    cur_keys, cur_vals = extract_columns(cur_rows, keys, metric)
+    prev_keys, prev_vals = extract_columns(prev_rows, keys, metric)
+
+    ci, pi = _join(cur_keys, prev_keys)
+    # pares na ordem do período atual: empates saem em ordem determinística
+    by_cur = np.argsort(ci, kind="stable")
+    ci, pi = ci[by_cur], pi[by_cur]
+
+    cur_v, prev_v = cur_vals[ci], prev_vals[pi]
+    delta_abs, delta_pct, trend = deltas(cur_v, prev_v)
+
+    rows = []
+    for j in _movers_order(delta_abs)[:limit]:
+        src = cur_rows[ci[j]]
+        row = {k: src[k] for k in keys}
+        row.update(
+            current=_as_value(cur_v[j]),
+            previous=_as_value(prev_v[j]),
+            delta_abs=_as_value(delta_abs[j]),
+            delta_pct=_as_value(delta_pct[j]),
+            trend=str(trend[j]),
+        )
+        rows.append(row)
+
+    def only_in(matched, vals, src_rows):
+        mask = np.ones(len(src_rows), dtype=bool)
+        mask[matched] = False
+        idx = np.flatnonzero(mask)
+        idx = idx[_movers_order(vals[idx])]
+        out = [
+            {**{k: src_rows[i][k] for k in keys}, "value": _as_value(vals[i])}
+            for i in idx[:limit]
+        ]
+        return out, len(idx)
+
+    only_current, n_only_current = only_in(ci, cur_vals, cur_rows)
+    only_previous, n_only_previous = only_in(pi, prev_vals, prev_rows)
+
+    return {
+        "counts": {
+            "matched": len(ci),
+            "only_current": n_only_current,
+            "only_previous": n_only_previous,
+        },
+        "rows": rows,
+        "only_current": only_current,
+        "only_previous": only_previous,
+    }
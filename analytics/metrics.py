@@ -33,6 +33,24 @@ METRICS = {
     "qtd_abaixo_custo_reposicao": "count(*) filter (where preco_unitario < custo_reposicao)::int as qtd_abaixo_custo_reposicao",
 }
 
+# razões acima decompostas em (numerador, denominador, valor com denominador 0):
+# o snapshot (DuckDB) seleciona as somas e divide fora do SQL com a regra de
+# escala do numeric do Postgres, já que DECIMAL/DECIMAL no DuckDB vira DOUBLE
+RATIO_METRICS = {
+    "mc_percentual_ponderado": ("sum(mc)", "sum(faturamento)", 0),
+    "preco_medio_ponderado": ("sum(faturamento)", "sum(quantidade)", 0),
+    "desconto_percentual_ponderado": (
+        "sum((preco_cheio-preco_unitario)*quantidade)",
+        "sum(preco_cheio*quantidade)",
+        0,
+    ),
+    "markup_medio_ponderado": (
+        "sum(faturamento)",
+        "sum(custo_reposicao*quantidade)",
+        None,
+    ),
+}
+
 METRIC_ALIASES = {
     # faturamento
     "faturamento_bruto": "faturamento_total",
@@ -2,6 +2,8 @@ from typing import Any, Literal, Optional
 
 from pydantic import BaseModel, Field
 
+from analytics.compare import MAX_GROUPS
+
 Op = Literal["=", "!=", ">", ">=", "<", "<=", "in", "between", "like", "ilike"]
 
 
@@ -51,3 +53,5 @@ class CompareRequest(BaseModel):
     filters: list[Filter] = Field(default_factory=list)
     group_by: list[str] = Field(default_factory=list)
     metric: str = "mc_percentual_ponderado"
+    # linhas devolvidas por lista no modo agrupado
+    limit: int = Field(200, ge=1, le=MAX_GROUPS)
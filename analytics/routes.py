@@ -3,9 +3,11 @@ from typing import Optional
 
 from fastapi import APIRouter, Header, HTTPException
 
+from analytics.compare import MAX_GROUPS, compare_grouped, compare_values
 from analytics.models import AnalyticsQuery, CompareRequest, TimeWindow
-from analytics.sql_builder import build_query, normalize_payload
-from core.db import run_query
+from analytics.snapshot import run_analytics
+from analytics.sql_builder import normalize_payload
+from core.admission import run_admitted
 from core.security import require_api_key
 from utils.time import month_end, timedelta
 
@@ -18,8 +20,7 @@ router = APIRouter()
 def analytics_query(payload: AnalyticsQuery, x_api_key: Optional[str] = Header(None)):
     require_api_key(x_api_key)
     payload = normalize_payload(payload)
-    sql, params, start, end = build_query(payload)
-    rows = run_query(sql, params)
+    rows, start, end = run_analytics(payload)
 
     return {
         "time_resolved": {"start": start, "end": end},
@@ -30,7 +31,7 @@ def analytics_query(payload: AnalyticsQuery, x_api_key: Optional[str] = Header(N
 
 
 @router.post("/compare")
-def analytics_compare(
+async def analytics_compare(
     req: CompareRequest, x_api_key: Optional[str] = Header(default=None)
 ):
     require_api_key(x_api_key)
@@ -40,6 +41,24 @@ def analytics_compare(
     if metric not in METRICS:
         raise HTTPException(400, f"Métrica inválida: {req.metric}")
 
+    # normaliza aliases/wildcards antes de montar a chave de coalescing
+    norm = normalize_payload(
+        AnalyticsQuery(filters=req.filters, group_by=req.group_by, metrics=[metric])
+    )
+    req.filters, req.group_by = norm.filters, norm.group_by
+    key = {
+        "anchor": [req.anchor.year, req.anchor.month],
+        "window_days": req.window_days,
+        "filters": [f.model_dump() for f in req.filters],
+        "group_by": req.group_by,
+        "metric": metric,
+        "limit": req.limit,
+    }
+
+    return await run_admitted("analytics/compare", key, lambda: compare_ranges(req, metric))
+
+
+def compare_ranges(req: CompareRequest, metric: str):
     # define âncora = fim do mês
     end_current = month_end(req.anchor.year, req.anchor.month)
     start_current = end_current - timedelta(days=req.window_days)
@@ -55,63 +74,61 @@ def analytics_compare(
             filters=req.filters,
             group_by=req.group_by,
             metrics=[metric],
-            limit=1000,
+            limit=MAX_GROUPS + 1,
         )
         q = normalize_payload(q)
-        sql, params, _, _ = build_query(q)
-        rows = run_query(sql, params)
+        rows, _, _ = run_analytics(q)
+
+        # corte arbitrário (sem order_by) faria grupos casados virarem "só em um período"
+        if len(rows) > MAX_GROUPS:
+            raise HTTPException(
+                400,
+                f"Mais de {MAX_GROUPS} grupos em um período; refine filtros ou group_by.",
+            )
 
         # sem group_by: retorna 1 linha com a métrica
         if not req.group_by:
             value = rows[0].get(metric) if rows else None  # type: ignore
             return value, rows
 
-        return None, rows  # se group_by, você vai comparar linha a linha (opcional)
+        return None, rows
 
     cur_value, cur_rows = run_range(start_current, end_current)
     prev_value, prev_rows = run_range(start_prev, end_prev)
 
     if req.group_by:
-        # versão simples: devolve as duas tabelas e o GPT interpreta
+        # join vetorizado por chave: delta por grupo + grupos só em um período
         return {
             "anchor": f"{req.anchor.year}-{req.anchor.month:02d}",
+            "metric": metric,
+            "group_by": req.group_by,
             "current": {
                 "start": start_current.isoformat(),
                 "end": end_current.isoformat(),
-                "rows": cur_rows,
             },
             "previous": {
                 "start": start_prev.isoformat(),
                 "end": end_prev.isoformat(),
-                "rows": prev_rows,
             },
-            "metric": metric,
+            **compare_grouped(cur_rows, prev_rows, req.group_by, metric, req.limit),
         }
 
-    # sem group_by: calcula delta
-    if cur_value is None or prev_value is None:
-        trend = "indefinido"
-        delta_abs = None
-        delta_pct = None
-    else:
-        delta_abs = cur_value - prev_value
-        delta_pct = (delta_abs / prev_value) if prev_value not in (0, None) else None
-        trend = "aclive" if delta_abs > 0 else "declive" if delta_abs < 0 else "estavel"
-
+    # sem group_by: calcula delta (float, como no modo agrupado)
+    result = compare_values(cur_value, prev_value)
     return {
         "anchor": f"{req.anchor.year}-{req.anchor.month:02d}",
         "metric": metric,
         "current": {
             "start": start_current.isoformat(),
             "end": end_current.isoformat(),
-            "value": cur_value,
+            "value": result["current"],
         },
         "previous": {
             "start": start_prev.isoformat(),
             "end": end_prev.isoformat(),
-            "value": prev_value,
+            "value": result["previous"],
         },
-        "delta_abs": delta_abs,
-        "delta_pct": delta_pct,
-        "trend": trend,
+        "delta_abs": result["delta_abs"],
+        "delta_pct": result["delta_pct"],
+        "trend": result["trend"],
     }
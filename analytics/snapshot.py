@@ -0,0 +1,504 @@
+import argparse
+import os
+import sys
+import threading
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Optional
+
+from core.config import PG_DSN, SNAPSHOT_DIR, SNAPSHOT_NUMERIC_SCALE, TABLE
+from core.db import run_query
+from utils.dbConn import test_db_connection
+from utils.time import resolve_time
+
+from .metrics import METRICS, RATIO_METRICS
+from .models import AnalyticsQuery, Filter, Having, OrderBy, TimeWindow
+from .sql_builder import build_query
+
+try:
+    import duckdb
+except ImportError:  # engine opcional: sem duckdb tudo vai ao Postgres
+    duckdb = None  # type: ignore
+
+
+# --------------------
+# Layout dos snapshots: SNAPSHOT_DIR/year=YYYY/month=MM/data.parquet
+# Só meses fechados (anteriores ao mês corrente) são exportados.
+# --------------------
+def snapshot_enabled() -> bool:
+    return bool(SNAPSHOT_DIR) and duckdb is not None
+
+
+def month_file(year: int, month: int) -> str:
+    return os.path.join(
+        SNAPSHOT_DIR, f"year={year}", f"month={month:02d}", "data.parquet"
+    )
+
+
+def next_month(first: date) -> date:
+    return (first.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def first_open_month() -> date:
+    return date.today().replace(day=1)
+
+
+def iter_months(start: date, end: date):
+    cur = start.replace(day=1)
+    while cur <= end:
+        yield cur
+        cur = next_month(cur)
+
+
+def _quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def plan_snapshot(start: str, end: str):
+    # só usa o snapshot se todo mês fechado da janela tiver parquet; a parte viva
+    # fica restrita aos meses abertos (o corrente), senão o Postgres deixaria de
+    # agregar e passaria a enviar linhas cruas de meses antigos ao DuckDB
+    if not snapshot_enabled():
+        return None
+    try:
+        start_d, end_d = date.fromisoformat(start), date.fromisoformat(end)
+    except ValueError:
+        return None
+
+    files: list[str] = []
+    live: Optional[list[date]] = None  # intervalo [início, fim) dos meses abertos
+    open_from = first_open_month()
+
+    for first in iter_months(start_d, end_d):
+        if first >= open_from:
+            live = [live[0] if live else first, next_month(first)]
+            continue
+        path = month_file(first.year, first.month)
+        if not os.path.exists(path):
+            return None
+        files.append(path)
+
+    if not files:
+        return None
+    return files, live
+
+
+_con = None
+_con_lock = threading.Lock()
+_pg_attached = False
+
+
+def _connection(attach_pg: bool):
+    # conexão DuckDB única por processo; cada requisição usa um cursor próprio
+    global _con, _pg_attached
+    with _con_lock:
+        if _con is None:
+            _con = duckdb.connect()  # type: ignore
+            _con.execute(
+                # equivalente ao unaccent() do Postgres usado nos filtros like/ilike;
+                # strip_accents não trata ligaduras/letras sem diacrítico combinante
+                "create macro unaccent(s) as strip_accents("
+                "replace(replace(replace(replace(replace(replace("
+                "s, 'ß', 'ss'), 'æ', 'ae'), 'œ', 'oe'), 'ø', 'o'), 'đ', 'd'), 'ł', 'l'))"
+            )
+        if attach_pg and not _pg_attached:
+            _con.execute("install postgres")
+            _con.execute("load postgres")
+            _con.execute(f"attach {_quote(PG_DSN)} as pg (type postgres, read_only)")
+            _pg_attached = True
+        return _con
+
+
+# --------------------
+# Colunas do Postgres -> parquet
+# --------------------
+_columns: Optional[list[tuple[str, Optional[str], bool]]] = None
+_columns_lock = threading.Lock()
+
+
+def pg_columns() -> list[tuple[str, Optional[str], bool]]:
+    # (coluna, cast no Postgres, checar perda) com o tipo real do information_schema:
+    # numeric(p,s) passa como está (vira DECIMAL(p,s) no DuckDB); numeric sem
+    # precisão ganha escala SNAPSHOT_NUMERIC_SCALE e é checado contra perda;
+    # precisão > 38 cai para 38 dígitos, o que estoura em vez de arredondar.
+    # Obs.: no numeric sem precisão a escala de uma soma no Postgres é a maior
+    # das linhas, aqui é sempre a fixa; valores batem, mas uma razão com
+    # quociente >= 10**(16 - escala) pode sair com casas a mais no snapshot
+    global _columns
+    with _columns_lock:
+        if _columns is None:
+            schema, _, name = TABLE.rpartition(".")
+            rows = run_query(
+                "select column_name, data_type, numeric_precision, numeric_scale"
+                " from information_schema.columns"
+                " where table_schema = coalesce(nullif(%s, ''), current_schema())"
+                " and table_name = %s order by ordinal_position",
+                [schema, name],
+            )
+            if not rows:
+                raise RuntimeError(f"Tabela {TABLE} não encontrada")
+
+            cols: list[tuple[str, Optional[str], bool]] = []
+            for r in rows:
+                col, precision = r["column_name"], r["numeric_precision"]  # type: ignore
+                if r["data_type"] != "numeric":  # type: ignore
+                    cols.append((col, None, False))
+                elif precision is None:
+                    cols.append((col, f"numeric(38,{SNAPSHOT_NUMERIC_SCALE})", True))
+                elif precision > 38:
+                    cols.append((col, f"numeric(38,{r['numeric_scale']})", False))  # type: ignore
+                else:
+                    cols.append((col, None, False))
+            _columns = cols
+        return _columns
+
+
+def pg_month_rows(first: date, end: date) -> str:
+    # linhas de [first, end) lidas no Postgres via postgres_query (os casts rodam
+    # lá, com o typmod certo); qualquer valor que não caiba sem arredondar aborta
+    # a consulta no DuckDB em vez de seguir com números diferentes do Postgres
+    select_parts, lossy = [], []
+    for col, cast, check in pg_columns():
+        select_parts.append(f"{col}::{cast} as {col}" if cast else col)
+        if check:
+            lossy.append(
+                f"coalesce({col} <> round({col}, {SNAPSHOT_NUMERIC_SCALE}), false)"
+            )
+
+    pg_sql = (
+        f"select {', '.join(select_parts)}, ({' or '.join(lossy) or 'false'})"
+        " as snapshot_lossy"
+        f" from {TABLE} where emissao >= {_quote(first.isoformat())}"
+        f" and emissao < {_quote(end.isoformat())}"
+    )
+    return (
+        f"select * exclude (snapshot_lossy) from postgres_query('pg', {_quote(pg_sql)})"
+        " where case when snapshot_lossy then error("
+        + _quote(
+            f"valor numeric com mais de {SNAPSHOT_NUMERIC_SCALE} casas em {TABLE}; "
+            "ajuste SNAPSHOT_NUMERIC_SCALE"
+        )
+        + ") else true end"
+    )
+
+
+def snapshot_source(files: list[str], live: Optional[list[date]]) -> str:
+    # parte snapshot (parquet) + meses abertos (Postgres), mesclados pelo DuckDB;
+    # o WHERE de build_query recorta a janela exata por cima disso
+    file_list = "[" + ", ".join(_quote(f) for f in files) + "]"
+    sql = f"select * from read_parquet({file_list}, hive_partitioning = false)"
+    if live:
+        sql += f" union all by name {pg_month_rows(live[0], live[1])}"
+    return f"({sql}) as snap"
+
+
+# --------------------
+# Razões: divisão numeric com a regra de escala do Postgres
+# --------------------
+def _digits(x: Decimal):
+    # (inteiro, expoente) com x == inteiro * 10**expoente
+    sign, digits, exp = x.as_tuple()
+    n = int("".join(map(str, digits)) or "0")
+    return (-n if sign else n), int(exp)
+
+
+def _weight_firstdigit(x: Decimal):
+    # peso e primeiro dígito de x na base 10000 em que o numeric é guardado
+    n, exp = _digits(abs(x))
+    if n == 0:
+        return 0, 0
+    weight = x.adjusted() // 4
+    shift = exp - 4 * weight
+    first = n * 10**shift if shift >= 0 else n // 10 ** (-shift)
+    return weight, first
+
+
+def pg_numeric_div(num, den):
+    # mesmo resultado de numeric / numeric no Postgres (select_div_scale + div_var
+    # exato): escala = max(16 - 4 * peso do quociente, escalas dos operandos),
+    # limitada a [0, 1000], arredondando metade para longe do zero
+    if isinstance(num, float) or isinstance(den, float):
+        return float(num) / float(den)
+    num, den = Decimal(num), Decimal(den)
+
+    w1, f1 = _weight_firstdigit(num)
+    w2, f2 = _weight_firstdigit(den)
+    qweight = w1 - w2 - (1 if f1 <= f2 else 0)
+    dscale1 = max(0, -num.as_tuple().exponent)  # type: ignore
+    dscale2 = max(0, -den.as_tuple().exponent)  # type: ignore
+    rscale = min(max(16 - 4 * qweight, dscale1, dscale2, 0), 1000)
+
+    n1, e1 = _digits(num)
+    n2, e2 = _digits(den)
+    shift = e1 - e2 + rscale
+    top, bottom = abs(n1), abs(n2)
+    if shift >= 0:
+        top *= 10**shift
+    else:
+        bottom *= 10 ** (-shift)
+    q, r = divmod(top, bottom)
+    if 2 * r >= bottom:
+        q += 1
+
+    sign = "-" if q and (n1 < 0) != (n2 < 0) else ""
+    return Decimal(f"{sign}{q}E-{rscale}")
+
+
+def ratio_value(metric: str, num, den):
+    # case when den = 0 then <zero> else num / den end, como em METRICS
+    zero = RATIO_METRICS[metric][2]
+    if den is None:
+        return None
+    if den == 0:
+        if zero is None:
+            return None
+        return float(zero) if isinstance(den, float) else Decimal(zero)
+    if num is None:
+        return None
+    return pg_numeric_div(num, den)
+
+
+def snapshot_supports(q: AnalyticsQuery) -> bool:
+    # having/order_by sobre razão dependeriam da divisão em DOUBLE do DuckDB
+    return not any(h.metric in RATIO_METRICS for h in q.having) and not any(
+        ob.metric in RATIO_METRICS for ob in q.order_by
+    )
+
+
+def run_on_snapshot(q: AnalyticsQuery, files: list[str], live: Optional[list[date]]):
+    sql, params, start, end = build_query(q, snapshot_source(files, live), split_ratios=True)
+
+    # período como date (no DuckDB o parâmetro string não é convertido sozinho)
+    params[0:2] = [date.fromisoformat(start), date.fromisoformat(end)]
+
+    if live and not test_db_connection(PG_DSN):
+        raise RuntimeError("Banco indisponível")
+
+    cur = _connection(attach_pg=bool(live)).cursor()
+    try:
+        cur.execute(sql.replace("%s", "?"), params)
+        cols = [c[0] for c in cur.description]
+        raw_rows = cur.fetchall()
+    finally:
+        cur.close()
+
+    # <métrica>__num / <métrica>__den -> <métrica>, na posição original
+    ratios = {c[: -len("__num")] for c in cols if c.endswith("__num")}
+    names = [c[: -len("__num")] if c.endswith("__num") else c for c in cols]
+    names = [c for c in names if not c.endswith("__den")]
+
+    rows = []
+    for r in raw_rows:
+        raw = dict(zip(cols, r))
+        rows.append(
+            {
+                c: ratio_value(c, raw[c + "__num"], raw[c + "__den"])
+                if c in ratios
+                else raw[c]
+                for c in names
+            }
+        )
+    return rows, start, end
+
+
+def run_analytics(q: AnalyticsQuery):
+    start, end = resolve_time(q.time)
+    plan = plan_snapshot(start, end)
+
+    if plan and snapshot_supports(q):
+        try:
+            return run_on_snapshot(q, *plan)
+        except duckdb.Error as e:  # type: ignore
+            print("Erro no snapshot, usando Postgres:", e)
+
+    sql, params, start, end = build_query(q)
+    return run_query(sql, params), start, end
+
+
+# --------------------
+# Exportação de meses fechados
+# --------------------
+def export_month(year: int, month: int) -> str:
+    if duckdb is None:
+        raise RuntimeError("Instale duckdb para gerar snapshots")
+    if not SNAPSHOT_DIR:
+        raise RuntimeError("Defina SNAPSHOT_DIR no .env")
+
+    first = date(year, month, 1)
+    if first >= first_open_month():
+        raise RuntimeError(f"Mês {year}-{month:02d} ainda não fechou")
+
+    path = month_file(year, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+
+    cur = _connection(attach_pg=True).cursor()
+    try:
+        cur.execute(
+            f"copy ({pg_month_rows(first, next_month(first))} order by emissao)"
+            f" to {_quote(tmp)} (format parquet)"
+        )
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    finally:
+        cur.close()
+
+    # troca atômica: leitores nunca veem um parquet pela metade
+    os.replace(tmp, path)
+    return path
+
+
+def export_range(start: date, end: date, force: bool = False) -> list[str]:
+    last_closed = first_open_month() - timedelta(days=1)
+    written = []
+    for first in iter_months(start, min(end, last_closed)):
+        if not force and os.path.exists(month_file(first.year, first.month)):
+            continue
+        written.append(export_month(first.year, first.month))
+    return written
+
+
+# --------------------
+# Checagem de consistência snapshot x Postgres
+# --------------------
+def _sort_key(row: dict, keys: list[str]):
+    return tuple(str(row.get(k)) for k in keys)
+
+
+def check_consistency(q: AnalyticsQuery) -> list[str]:
+    start, end = resolve_time(q.time)
+    plan = plan_snapshot(start, end)
+    if not plan:
+        return [f"{start}..{end}: janela não coberta por snapshot"]
+
+    sql, params, _, _ = build_query(q.model_copy(deep=True))
+    pg_rows = run_query(sql, params)
+    snap_rows, _, _ = run_on_snapshot(q.model_copy(deep=True), *plan)
+    return compare_rows(q, pg_rows, snap_rows)  # type: ignore
+
+
+def compare_rows(q: AnalyticsQuery, expected: list[dict], got: list[dict]) -> list[str]:
+    # sem order_by o limit corta um subconjunto arbitrário de cada lado
+    if len(expected) >= q.limit or len(got) >= q.limit:
+        return [f"limite de {q.limit} linhas atingido: comparação inconclusiva"]
+    if len(expected) != len(got):
+        return [f"{len(expected)} linhas esperadas, {len(got)} no snapshot"]
+
+    errors = []
+    # com order_by, a sequência das métricas ordenadas tem de bater (empates
+    # podem trocar as chaves de lugar); as linhas em si comparam como conjunto
+    for ob in q.order_by:
+        if [r[ob.metric] for r in expected] != [r[ob.metric] for r in got]:
+            errors.append(f"ordem de {ob.metric} difere")
+
+    expected = sorted(expected, key=lambda r: _sort_key(r, q.group_by))
+    got = sorted(got, key=lambda r: _sort_key(r, q.group_by))
+    for exp_row, got_row in zip(expected, got):
+        if list(exp_row) != list(got_row):
+            errors.append(f"colunas: esperado={list(exp_row)} snapshot={list(got_row)}")
+            break
+        for col, value in exp_row.items():
+            # str também compara a escala (12.50 x 12.500000 em razões)
+            if value != got_row[col] or (
+                col in RATIO_METRICS and str(value) != str(got_row[col])
+            ):
+                errors.append(
+                    f"{_sort_key(exp_row, q.group_by)} {col}: "
+                    f"esperado={value!r} snapshot={got_row[col]!r}"
+                )
+    return errors
+
+
+def default_checks(
+    start: str, end: str, limit: int = 1_000_000
+) -> dict[str, AnalyticsQuery]:
+    start_d, end_d = date.fromisoformat(start), date.fromisoformat(end)
+    mid = start_d + (end_d - start_d) / 2
+
+    def q(**kw) -> AnalyticsQuery:
+        return AnalyticsQuery(
+            time=TimeWindow(mode="range", start=start, end=end),
+            metrics=list(METRICS),
+            limit=limit,
+            **kw,
+        )
+
+    return {
+        "total": q(),
+        "uf": q(group_by=["uf"]),
+        "marca, tipo_estoque": q(group_by=["marca", "tipo_estoque"]),
+        "cliente": q(group_by=["cliente"]),
+        "produto_id": q(group_by=["produto_id"]),
+        # unaccent (Postgres) x macro sobre strip_accents (DuckDB)
+        "ilike descricao": q(
+            group_by=["descricao"],
+            filters=[Filter(field="descricao", op="ilike", value="%ção%")],
+        ),
+        "ilike cliente": q(
+            group_by=["cliente"],
+            filters=[Filter(field="cliente", op="ilike", value="%a%")],
+        ),
+        "in uf": q(
+            group_by=["uf"],
+            filters=[
+                Filter(field="uf", op="in", value=["SP", "MG", "RJ", "PR", "SC"])
+            ],
+        ),
+        # filtro de data em string, fora do período já convertido em date
+        "between emissao": q(
+            group_by=["marca"],
+            filters=[
+                Filter(field="emissao", op="between", value=[start, mid.isoformat()])
+            ],
+        ),
+        "having + order_by": q(
+            group_by=["cliente"],
+            having=[Having(metric="faturamento_total", op=">", value=0)],
+            order_by=[OrderBy(metric="faturamento_total", dir="desc")],
+        ),
+    }
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m analytics.snapshot")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    exp = sub.add_parser("export", help="exporta meses fechados para parquet")
+    exp.add_argument("--start", required=True, help="YYYY-MM")
+    exp.add_argument("--end", help="YYYY-MM (padrão: último mês fechado)")
+    exp.add_argument("--force", action="store_true", help="regrava meses existentes")
+
+    chk = sub.add_parser("check", help="compara snapshot x Postgres")
+    chk.add_argument("--start", required=True, help="YYYY-MM-DD")
+    chk.add_argument("--end", default=date.today().isoformat(), help="YYYY-MM-DD")
+    chk.add_argument(
+        "--limit", type=int, default=1_000_000, help="máximo de grupos por consulta"
+    )
+
+    args = parser.parse_args(argv)
+
+    if args.cmd == "export":
+        start = date.fromisoformat(args.start + "-01")
+        end = (
+            date.fromisoformat(args.end + "-01")
+            if args.end
+            else first_open_month() - timedelta(days=1)
+        )
+        for path in export_range(start, end, args.force):
+            print("ok", path)
+        return 0
+
+    failures = 0
+    for name, q in default_checks(args.start, args.end, args.limit).items():
+        errors = check_consistency(q)
+        print("OK  " if not errors else "FAIL", name)
+        for err in errors[:20]:
+            print("    ", err)
+        failures += bool(errors)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,7 +6,7 @@ from core.config import TABLE
 from utils.time import resolve_time
 
 from .fields import ALLOWED_FIELDS, FIELD_ALIASES
-from .metrics import METRIC_ALIASES, METRICS
+from .metrics import METRIC_ALIASES, METRICS, RATIO_METRICS
 from .models import AnalyticsQuery, Filter
 
 
@@ -81,7 +81,14 @@ def expr_of_metric(metric: str) -> str:
     return METRICS[metric].split(" as ")[0]
 
 
-def build_query(q: AnalyticsQuery):
+def build_query(
+    q: AnalyticsQuery,
+    source: str = TABLE,
+    split_ratios: bool = False,
+):
+    # `source` permite trocar a origem das linhas (ex.: snapshot parquet no DuckDB);
+    # `split_ratios` seleciona numerador e denominador das razões em vez do
+    # quociente (colunas <métrica>__num / <métrica>__den), divididos por quem chama
     start, end = resolve_time(q.time)
     params: list[Any] = []
 
@@ -99,9 +106,13 @@ def build_query(q: AnalyticsQuery):
 
     for m in q.metrics:
         validate_metric(m)
-        select_parts.append(METRICS[m])
+        if split_ratios and m in RATIO_METRICS:
+            num, den, _ = RATIO_METRICS[m]
+            select_parts.append(f"{num} as {m}__num, {den} as {m}__den")
+        else:
+            select_parts.append(METRICS[m])
 
-    sql = f"select {', '.join(select_parts)} from {TABLE}"
+    sql = f"select {', '.join(select_parts)} from {source}"
 
     # WHERE com período
     params.extend([start, end])
@@ -0,0 +1,137 @@
+# Benchmark do compare agrupado (analytics.compare.compare_grouped).
+#
+#   python -m benchmarks.compare_grouped --keys 100000 --budget-ms 1000
+#
+# Confere que o join vetorizado devolve exatamente o mesmo resultado de uma
+# referência ingênua (join por dict linha a linha, só para o benchmark) e
+# falha (exit 1) se o melhor tempo passar do orçamento. O tempo é separado em
+# extração linha a linha (dicts -> listas/arrays, em Python) e o restante
+# (hash das chaves, join, deltas e ordenação); só esse restante é vetorizado.
+import argparse
+import random
+import sys
+import time
+from typing import Optional
+
+from analytics.compare import MAX_GROUPS, compare_grouped, extract_columns
+
+
+def compare_dict_loop(cur_rows, prev_rows, keys, metric, limit=200):
+    def key_of(r):
+        return tuple(r[k] for k in keys)
+
+    def mover(x):
+        return -abs(x) if x is not None else 1
+
+    prev = {key_of(r): r for r in prev_rows}
+    seen, rows, only_current = set(), [], []
+    for r in cur_rows:
+        key = key_of(r)
+        p = prev.get(key)
+        if p is None:
+            only_current.append({**dict(zip(keys, key)), "value": r[metric]})
+            continue
+        seen.add(key)
+        cur_v, prev_v = r[metric], p[metric]
+        d = None if cur_v is None or prev_v is None else cur_v - prev_v
+        if d is None:
+            trend = "indefinido"
+        else:
+            trend = "aclive" if d > 0 else "declive" if d < 0 else "estavel"
+        rows.append(
+            {
+                **dict(zip(keys, key)),
+                "current": cur_v,
+                "previous": prev_v,
+                "delta_abs": d,
+                "delta_pct": d / prev_v if d is not None and prev_v else None,
+                "trend": trend,
+            }
+        )
+    only_previous = [
+        {**dict(zip(keys, k)), "value": p[metric]}
+        for k, p in prev.items()
+        if k not in seen
+    ]
+
+    rows.sort(key=lambda r: mover(r["delta_abs"]))
+    only_current.sort(key=lambda r: mover(r["value"]))
+    only_previous.sort(key=lambda r: mover(r["value"]))
+    return {
+        "counts": {
+            "matched": len(rows),
+            "only_current": len(only_current),
+            "only_previous": len(only_previous),
+        },
+        "rows": rows[:limit],
+        "only_current": only_current[:limit],
+        "only_previous": only_previous[:limit],
+    }
+
+
+def fake_rows(n: int, metric: str, seed: int) -> list:
+    # ~95% das chaves em cada período; alguns valores nulos
+    rnd = random.Random(seed)
+    rows = [
+        {
+            "cliente": f"C{i:06d}",
+            "uf": "SP" if i % 2 else "MG",
+            metric: None if rnd.random() < 0.01 else rnd.uniform(-1, 1),
+        }
+        for i in range(n)
+    ]
+    rnd.shuffle(rows)
+    return rows[: int(n * 0.95)]
+
+
+def best_of(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.compare_grouped")
+    parser.add_argument("--keys", type=int, default=MAX_GROUPS)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=1000.0)
+    args = parser.parse_args(argv)
+
+    metric, keys = "mc_percentual_ponderado", ["cliente", "uf"]
+    cur_rows = fake_rows(args.keys, metric, 1)
+    prev_rows = fake_rows(args.keys, metric, 2)
+
+    # mesma saída, inclusive a ordem (valores aleatórios: sem empates)
+    everything = len(cur_rows) + len(prev_rows)
+    expected = compare_dict_loop(cur_rows, prev_rows, keys, metric, everything)
+    got = compare_grouped(cur_rows, prev_rows, keys, metric, everything)
+    if got != expected:
+        print("FAIL saída difere da referência")
+        return 1
+
+    t_vec = best_of(lambda: compare_grouped(cur_rows, prev_rows, keys, metric), args.repeat)
+    t_extract = best_of(
+        lambda: (
+            extract_columns(cur_rows, keys, metric),
+            extract_columns(prev_rows, keys, metric),
+        ),
+        args.repeat,
+    )
+    t_ref = best_of(
+        lambda: compare_dict_loop(cur_rows, prev_rows, keys, metric), args.repeat
+    )
+    ok = t_vec * 1000 <= args.budget_ms
+    print(
+        f"{'OK  ' if ok else 'FAIL'} {args.keys} chaves: numpy {t_vec * 1000:.1f} ms"
+        f" (orçamento {args.budget_ms:.0f} ms; extração por linha"
+        f" {t_extract * 1000:.1f} ms) | dict loop {t_ref * 1000:.1f} ms"
+        f" | {t_ref / t_vec:.1f}x"
+    )
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
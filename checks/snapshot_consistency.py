@@ -0,0 +1,419 @@
+# Checagem autocontida do snapshot DuckDB (analytics.snapshot), sem Postgres:
+#
+#   python -m checks.snapshot_consistency
+#
+# Gera meses parquet pequenos com DuckDB em memória, roda run_on_snapshot e
+# compara com uma referência exata em Python (Decimal), inclusive razões,
+# ilike com acentos e between em emissao. A divisão de referência é uma
+# implementação independente da regra de escala do numeric, e ambas são
+# conferidas contra resultados gravados de um Postgres 16. Também cobre os
+# casos de plan_snapshot. Sai com 1 em qualquer divergência.
+import os
+
+# core.config exige PG_DSN; nada aqui conecta no Postgres
+os.environ.setdefault("PG_DSN", "postgresql://snapshot-check@localhost/none")
+
+import csv  # noqa: E402
+import random  # noqa: E402
+import re  # noqa: E402
+import sys  # noqa: E402
+import tempfile  # noqa: E402
+import unicodedata  # noqa: E402
+from datetime import date  # noqa: E402
+from decimal import ROUND_HALF_UP, Decimal, localcontext  # noqa: E402
+from functools import reduce  # noqa: E402
+from operator import add  # noqa: E402
+from typing import Optional  # noqa: E402
+
+import duckdb  # noqa: E402
+
+from analytics import snapshot  # noqa: E402
+from analytics.metrics import METRICS, RATIO_METRICS  # noqa: E402
+from analytics.models import (  # noqa: E402
+    AnalyticsQuery,
+    Filter,
+    Having,
+    OrderBy,
+    TimeWindow,
+)
+
+# select numerador::numeric / denominador::numeric num Postgres 16
+PG16_DIVISIONS = [
+    ("807067.142803", "14.154982", "57016.472560897640"),
+    ("1", "3", "0.33333333333333333333"),
+    ("2", "3", "0.66666666666666666667"),
+    ("0", "7.25", "0E-20"),
+    ("-5.5", "3", "-1.8333333333333333"),
+    ("123.45", "0.000001", "123450000.00000000"),
+    ("0.000123", "98765.4321", "1.2453749999844328125E-9"),
+    ("99999999.99", "0.01", "9999999999.00000000"),
+    ("12345678901234.56", "0.03", "411522630041152.0000"),
+    ("1.00", "1.00", "1.00000000000000000000"),
+    ("9999", "10000", "0.99990000000000000000"),
+    ("10000", "9999", "1.0001000100010001"),
+    ("0.5", "0.5000", "1.00000000000000000000"),
+    ("5417.39", "12", "451.4491666666666667"),
+    ("3.141592653589793", "2.718281828459045", "1.1557273497909217"),
+    ("-0.0001", "-3", "0.000033333333333333333333"),
+    ("7", "0.0000000001", "70000000000.0000000000"),
+    ("1234567.123456", "7654321.654321", "0.16129020691978171781"),
+]
+
+COLUMNS = {
+    "emissao": "date",
+    "produto_id": "integer",
+    "descricao": "varchar",
+    "marca": "varchar",
+    "tipo_estoque": "varchar",
+    "cliente": "varchar",
+    "uf": "varchar",
+    "quantidade": "decimal(14,3)",
+    "preco_cheio": "decimal(14,2)",
+    "preco_unitario": "decimal(14,4)",
+    "faturamento": "decimal(16,2)",
+    "cmv": "decimal(16,2)",
+    "mc": "decimal(16,2)",
+    "custo_reposicao": "decimal(14,4)",
+}
+
+MONTHS = [date(2024, m, 1) for m in (1, 2, 3, 4)]
+
+
+# --------------------
+# Dados
+# --------------------
+def fake_rows(n: int = 1500, seed: int = 7) -> list[dict]:
+    rnd = random.Random(seed)
+    descricoes = ["AÇÃO Fria", "Ação quente", "acao morna", "Straße", "Œuvre", "Cabo"]
+    rows = []
+    for i in range(n):
+        month = rnd.choice(MONTHS)
+        cliente = f"CLIENTE {rnd.randrange(12)}"
+        qtd = Decimal(rnd.randrange(1, 50_000)).scaleb(-3)
+        cheio = Decimal(rnd.randrange(100, 90_000)).scaleb(-2)
+        unit = (cheio * Decimal(rnd.randrange(70, 101)) / 100).quantize(Decimal("0.0001"))
+        fat = (qtd * unit).quantize(Decimal("0.01"))
+        cmv = (fat * Decimal(rnd.randrange(40, 95)) / 100).quantize(Decimal("0.01"))
+        if cliente == "CLIENTE 0":
+            # faturamento zerado: razões caem no ramo "denominador = 0"
+            qtd, fat, cmv = Decimal("0.000"), Decimal("0.00"), Decimal("0.00")
+        rows.append(
+            {
+                "emissao": month.replace(day=rnd.randrange(1, 29)),
+                "produto_id": rnd.randrange(40),
+                "descricao": rnd.choice(descricoes),
+                "marca": rnd.choice(["ACME", "Zeta", "Ômega"]),
+                "tipo_estoque": rnd.choice(["PRÓPRIO", "CONSIGNADO"]),
+                "cliente": cliente,
+                "uf": rnd.choice(["SP", "MG", "RJ", "PR", "SC", "BA"]),
+                "quantidade": qtd,
+                "preco_cheio": cheio,
+                "preco_unitario": unit,
+                "faturamento": fat,
+                "cmv": cmv,
+                "mc": None if i % 17 == 0 else fat - cmv,
+                # sem custo no CLIENTE 1: markup com denominador nulo
+                "custo_reposicao": None
+                if cliente == "CLIENTE 1"
+                else (unit * Decimal(rnd.randrange(60, 120)) / 100).quantize(
+                    Decimal("0.0001")
+                ),
+            }
+        )
+    return rows
+
+
+def write_months(rows: list[dict], root: str):
+    # linhas -> csv tipado -> um parquet por mês (parâmetros Decimal no DuckDB são lentos)
+    csv_path = os.path.join(root, "rows.csv")
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerows([r[c] for c in COLUMNS] for r in rows)
+
+    con = duckdb.connect()
+    types = ", ".join(f"'{c}': '{t}'" for c, t in COLUMNS.items())
+    con.execute(
+        f"create table t as select * from read_csv('{csv_path}',"
+        f" header = false, columns = {{{types}}})"
+    )
+    for first in MONTHS:
+        path = os.path.join(
+            root, f"year={first.year}", f"month={first.month:02d}", "data.parquet"
+        )
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        end = snapshot.next_month(first)
+        con.execute(
+            f"copy (select * from t where emissao >= '{first}' and emissao < '{end}'"
+            f" order by emissao) to '{path}' (format parquet)"
+        )
+    con.close()
+    os.remove(csv_path)
+
+
+# --------------------
+# Referência exata
+# --------------------
+def reference_div(num: Decimal, den: Decimal) -> Decimal:
+    # regra de escala de numeric / numeric do Postgres via aritmética Decimal
+    def weight_first(x: Decimal):
+        x = abs(x)
+        if not x:
+            return 0, 0
+        weight = x.adjusted() // 4
+        return weight, int(x.scaleb(-4 * weight))
+
+    with localcontext() as ctx:
+        ctx.prec = 2000
+        w1, f1 = weight_first(num)
+        w2, f2 = weight_first(den)
+        qweight = w1 - w2 - (1 if f1 <= f2 else 0)
+        scale = min(
+            max(16 - 4 * qweight, -num.as_tuple().exponent, -den.as_tuple().exponent, 0),  # type: ignore
+            1000,
+        )
+        q = (num / den).quantize(Decimal(1).scaleb(-scale), rounding=ROUND_HALF_UP)
+    return q.copy_abs() if not q else q
+
+
+def unaccent(s: str) -> str:
+    for a, b in (("ß", "ss"), ("æ", "ae"), ("œ", "oe"), ("ø", "o"), ("đ", "d"), ("ł", "l")):
+        s = s.replace(a, b)
+    return "".join(
+        c for c in unicodedata.normalize("NFD", s) if not unicodedata.combining(c)
+    )
+
+
+def like(value: str, pattern: str) -> bool:
+    regex = "".join(
+        ".*" if c == "%" else "." if c == "_" else re.escape(c) for c in pattern
+    )
+    return re.fullmatch(regex, value, re.S) is not None
+
+
+def _value(field: str, v):
+    return date.fromisoformat(v) if field == "emissao" and isinstance(v, str) else v
+
+
+def matches(row: dict, f: Filter) -> bool:
+    v = row[f.field]
+    if v is None:
+        return False
+    if f.op == "in":
+        return v in [_value(f.field, x) for x in f.value]
+    if f.op == "between":
+        lo, hi = (_value(f.field, x) for x in f.value)
+        return lo <= v <= hi
+    if f.op in ("like", "ilike"):
+        return like(unaccent(v.lower()), unaccent(f.value.lower()))
+    ops = {"=": "__eq__", "!=": "__ne__", ">": "__gt__", ">=": "__ge__", "<": "__lt__", "<=": "__le__"}
+    return getattr(v, ops[f.op])(_value(f.field, f.value))
+
+
+def _sum(values) -> Optional[Decimal]:
+    values = [v for v in values if v is not None]
+    return reduce(add, values) if values else None
+
+
+def _coalesce(v, zero=Decimal(0)):
+    return zero if v is None else v
+
+
+def _product(a, b):
+    return None if a is None or b is None else a * b
+
+
+def reference_metrics(rows: list[dict]) -> dict:
+    fat = _sum(r["faturamento"] for r in rows)
+    qtd = _sum(r["quantidade"] for r in rows)
+    mc = _sum(r["mc"] for r in rows)
+    cheio = _sum(_product(r["preco_cheio"], r["quantidade"]) for r in rows)
+    desconto = _sum(
+        _product(r["preco_cheio"] - r["preco_unitario"], r["quantidade"]) for r in rows
+    )
+    custo = _sum(_product(r["custo_reposicao"], r["quantidade"]) for r in rows)
+
+    def ratio(metric, num, den):
+        zero = RATIO_METRICS[metric][2]
+        if den is None:
+            return None
+        if den == 0:
+            return None if zero is None else Decimal(zero)
+        return None if num is None else reference_div(num, den)
+
+    return {
+        "linhas": len(rows),
+        "qtde_total": int(_coalesce(qtd).to_integral_value(ROUND_HALF_UP)),
+        "faturamento_total": _coalesce(fat),
+        "mc_total": _coalesce(mc),
+        "cmv_total": _coalesce(_sum(r["cmv"] for r in rows)),
+        "mc_percentual_ponderado": ratio("mc_percentual_ponderado", mc, fat),
+        "preco_medio_ponderado": ratio("preco_medio_ponderado", fat, qtd),
+        "faturamento_preco_cheio_total": _coalesce(cheio),
+        "desconto_total": _coalesce(desconto),
+        "desconto_percentual_ponderado": ratio(
+            "desconto_percentual_ponderado", desconto, cheio
+        ),
+        "custo_reposicao_total": _coalesce(custo),
+        "markup_medio_ponderado": ratio("markup_medio_ponderado", fat, custo),
+        "qtd_abaixo_custo_reposicao": sum(
+            1
+            for r in rows
+            if r["custo_reposicao"] is not None
+            and r["preco_unitario"] < r["custo_reposicao"]
+        ),
+    }
+
+
+def reference_query(rows: list[dict], q: AnalyticsQuery) -> list[dict]:
+    start, end = date.fromisoformat(q.time.start), date.fromisoformat(q.time.end)  # type: ignore
+    groups: dict[tuple, list[dict]] = {}
+    for r in rows:
+        if start <= r["emissao"] <= end and all(matches(r, f) for f in q.filters):
+            groups.setdefault(tuple(r[g] for g in q.group_by), []).append(r)
+    if not q.group_by and not groups:
+        groups[()] = []
+
+    out = []
+    for key, members in groups.items():
+        values = reference_metrics(members)
+        if all(
+            getattr(values[h.metric], f"__{op}__")(Decimal(str(h.value)))
+            for h in q.having
+            for op in [{"=": "eq", "!=": "ne", ">": "gt", ">=": "ge", "<": "lt", "<=": "le"}[h.op]]
+        ):
+            out.append({**dict(zip(q.group_by, key)), **{m: values[m] for m in q.metrics}})
+
+    for ob in reversed(q.order_by):
+        out.sort(key=lambda r: r[ob.metric], reverse=ob.dir == "desc")
+    return out[: q.limit]
+
+
+# --------------------
+# Casos
+# --------------------
+def queries() -> dict[str, AnalyticsQuery]:
+    def q(start="2024-01-10", end="2024-04-20", **kw) -> AnalyticsQuery:
+        return AnalyticsQuery(
+            time=TimeWindow(mode="range", start=start, end=end),
+            metrics=list(METRICS),
+            limit=100_000,
+            **kw,
+        )
+
+    return {
+        "total": q(),
+        "cliente": q(group_by=["cliente"]),
+        "marca, tipo_estoque": q(group_by=["marca", "tipo_estoque"]),
+        "produto_id": q(group_by=["produto_id"]),
+        "ilike descricao": q(
+            group_by=["descricao"],
+            filters=[Filter(field="descricao", op="ilike", value="%ção%")],
+        ),
+        "ilike ß -> ss": q(
+            group_by=["cliente"],
+            filters=[Filter(field="descricao", op="ilike", value="%STRASSE%")],
+        ),
+        "between emissao": q(
+            group_by=["marca"],
+            filters=[
+                Filter(field="emissao", op="between", value=["2024-02-03", "2024-03-17"])
+            ],
+        ),
+        "in uf": q(
+            group_by=["uf"],
+            filters=[Filter(field="uf", op="in", value=["SP", "MG", "RJ"])],
+        ),
+        "having + order_by": q(
+            group_by=["cliente"],
+            having=[Having(metric="faturamento_total", op=">", value=0)],
+            order_by=[OrderBy(metric="faturamento_total", dir="desc")],
+        ),
+        "janela vazia": q(start="2024-02-10", end="2024-02-09"),
+    }
+
+
+def check_divisions() -> list[str]:
+    errors = []
+    for a, b, expected in PG16_DIVISIONS:
+        for name, fn in (("pg_numeric_div", snapshot.pg_numeric_div), ("referência", reference_div)):
+            got = str(fn(Decimal(a), Decimal(b)))
+            if got != expected:
+                errors.append(f"{name}({a}, {b}) = {got}, Postgres = {expected}")
+
+    rnd = random.Random(11)
+    for _ in range(5000):
+        num = Decimal(rnd.randrange(-10**12, 10**12)).scaleb(-rnd.randrange(0, 9))
+        den = Decimal(rnd.randrange(1, 10**10)).scaleb(-rnd.randrange(0, 9))
+        if str(snapshot.pg_numeric_div(num, den)) != str(reference_div(num, den)):
+            errors.append(f"pg_numeric_div({num}, {den}) difere da referência")
+            break
+    return errors
+
+
+def check_plans() -> list[str]:
+    errors = []
+    m = snapshot.month_file
+    open_month = snapshot.first_open_month
+    snapshot.first_open_month = lambda: date(2024, 4, 1)  # abril ainda aberto
+    try:
+        cases = {
+            "meses fechados": (
+                ("2024-01-10", "2024-03-20"),
+                ([m(2024, 1), m(2024, 2), m(2024, 3)], None),
+            ),
+            # parte viva = só os meses abertos, nunca o início da janela
+            "com mês aberto": (
+                ("2024-02-15", "2024-05-10"),
+                ([m(2024, 2), m(2024, 3)], [date(2024, 4, 1), date(2024, 6, 1)]),
+            ),
+            "mês fechado sem parquet": (("2023-12-20", "2024-02-01"), None),
+            "só mês aberto": (("2024-04-02", "2024-04-30"), None),
+        }
+        for name, ((start, end), expected) in cases.items():
+            got = snapshot.plan_snapshot(start, end)
+            if got != expected:
+                errors.append(f"plan_snapshot {name}: {got} != {expected}")
+    finally:
+        snapshot.first_open_month = open_month
+
+    ratio_order = AnalyticsQuery(order_by=[OrderBy(metric="mc_percentual_ponderado")])
+    if snapshot.snapshot_supports(ratio_order):
+        errors.append("order_by em razão deveria ir ao Postgres")
+    if not snapshot.snapshot_supports(AnalyticsQuery()):
+        errors.append("consulta padrão deveria usar o snapshot")
+    return errors
+
+
+def main() -> int:
+    failures = 0
+
+    def report(name: str, errors: list[str]):
+        nonlocal failures
+        print("OK  " if not errors else "FAIL", name)
+        for err in errors[:20]:
+            print("    ", err)
+        failures += bool(errors)
+
+    report("divisão numeric x Postgres 16", check_divisions())
+
+    rows = fake_rows()
+    with tempfile.TemporaryDirectory() as root:
+        snapshot.SNAPSHOT_DIR = root
+        write_months(rows, root)
+        report("plan_snapshot", check_plans())
+
+        for name, q in queries().items():
+            start, end = q.time.start, q.time.end
+            plan = snapshot.plan_snapshot(start, end)  # type: ignore
+            if not plan or plan[1]:
+                report(name, [f"sem plano só de parquet: {plan}"])
+                continue
+            expected = reference_query(rows, q.model_copy(deep=True))
+            got, _, _ = snapshot.run_on_snapshot(q.model_copy(deep=True), *plan)
+            report(name, snapshot.compare_rows(q, expected, got))
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+import asyncio
+import json
+from typing import Any, Callable
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from core.config import (
+    ADMISSION_MAX_CONCURRENCY,
+    ADMISSION_QUEUE_TIMEOUT,
+    ADMISSION_RETRY_AFTER,
+)
+
+
+# Controle de admissão por endpoint:
+# - requisições idênticas em andamento compartilham uma única execução
+# - no máximo `max_concurrency` execuções simultâneas no banco
+# - quem espera na fila mais que `queue_timeout` recebe 503 + Retry-After
+# A espera (fila e coalescing) é assíncrona: só as execuções ocupam thread do
+# threadpool, então um pico de requisições idênticas não trava as outras rotas.
+class EndpointGate:
+
+    def __init__(self, name: str, max_concurrency: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+
+        self._sem = asyncio.Semaphore(max_concurrency)
+        self._inflight: dict[str, asyncio.Future] = {}
+
+        # métricas
+        self.queue_depth = 0  # líderes esperando vaga no semáforo
+        self.followers = 0  # requisições esperando o resultado de outra idêntica
+        self.running = 0
+        self.executed = 0
+        self.coalesced = 0
+        self.shed = 0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _overloaded(self) -> HTTPException:
+        return HTTPException(
+            503,
+            f"Servidor sobrecarregado em {self.name}, tente novamente.",
+            headers={"Retry-After": str(ADMISSION_RETRY_AFTER)},
+        )
+
+    async def run(self, key: str, fn: Callable[[], Any]) -> Any:
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.coalesced += 1
+            self.followers += 1
+            try:
+                # shield: um seguidor cancelado não cancela o líder
+                return await asyncio.shield(fut)
+            except asyncio.CancelledError:
+                if fut.cancelled():
+                    raise self._overloaded()
+                raise
+            finally:
+                self.followers -= 1
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            fut.set_result(await self._execute(fn))
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as e:
+            fut.set_exception(e)
+        finally:
+            self._inflight.pop(key, None)
+
+        return fut.result()
+
+    async def _execute(self, fn: Callable[[], Any]) -> Any:
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        self.queue_depth += 1
+        try:
+            await asyncio.wait_for(self._sem.acquire(), self.queue_timeout)
+        except TimeoutError:
+            self.shed += 1
+            raise self._overloaded()
+        finally:
+            self.queue_depth -= 1
+            waited = loop.time() - t0
+            self.waits += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+        self.running += 1
+        try:
+            return await run_in_threadpool(fn)
+        finally:
+            self._sem.release()
+            self.running -= 1
+            self.executed += 1
+
+    def snapshot(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "queue_timeout_s": self.queue_timeout,
+            "queue_depth": self.queue_depth,
+            "followers_waiting": self.followers,
+            "running": self.running,
+            "inflight_keys": len(self._inflight),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "shed": self.shed,
+            "wait_avg_s": self.wait_total / self.waits if self.waits else 0.0,
+            "wait_max_s": self.wait_max,
+        }
+
+
+_gates: dict[str, EndpointGate] = {}
+
+
+def get_gate(name: str) -> EndpointGate:
+    gate = _gates.get(name)
+    if gate is None:
+        gate = EndpointGate(name, ADMISSION_MAX_CONCURRENCY, ADMISSION_QUEUE_TIMEOUT)
+        _gates[name] = gate
+    return gate
+
+
+def request_key(payload: Any) -> str:
+    # chave canônica: mesma requisição normalizada -> mesma string
+    return json.dumps(payload, sort_keys=True, default=str, separators=(",", ":"))
+
+
+async def run_admitted(endpoint: str, payload: Any, fn: Callable[[], Any]) -> Any:
+    return await get_gate(endpoint).run(request_key(payload), fn)
+
+
+def admission_metrics() -> dict:
+    return {name: gate.snapshot() for name, gate in list(_gates.items())}
@@ -9,3 +9,14 @@ API_KEY = os.getenv("API_KEY", "").strip()
 
 if not PG_DSN:
     raise RuntimeError("Defina PG_DSN no .env")
+
+# controle de admissão (coalescing + limite de concorrência por endpoint)
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "4"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "5"))
+
+# snapshots parquet de meses fechados (vazio = desligado, tudo vai ao Postgres)
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "").strip()
+# escala usada no snapshot para colunas numeric sem precisão declarada; a
+# exportação falha se algum valor precisar de mais casas que isso
+SNAPSHOT_NUMERIC_SCALE = int(os.getenv("SNAPSHOT_NUMERIC_SCALE", "6"))
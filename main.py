@@ -1,7 +1,11 @@
-from fastapi import FastAPI
+from typing import Optional
+
+from fastapi import FastAPI, Header
 
 from analytics.routes import router as analytics_router
 from clients.routes import router as clients_router
+from core.admission import admission_metrics
+from core.security import require_api_key
 from segments.routes import router as segments_router
 
 app = FastAPI(title="Pricing Analytics API", version="1.1.0")
@@ -14,3 +18,9 @@ app.include_router(clients_router, prefix="/clients")
 @app.get("/health")
 def health():
     return {"ok": True}
+
+
+@app.get("/metrics")
+def metrics(x_api_key: Optional[str] = Header(None)):
+    require_api_key(x_api_key)
+    return {"admission": admission_metrics()}
@@ -2,6 +2,7 @@ from typing import Optional
 
 from fastapi import APIRouter, Header, HTTPException
 
+from core.admission import run_admitted
 from core.config import TABLE
 from core.db import run_query
 from core.security import require_api_key
@@ -13,7 +14,7 @@ router = APIRouter()
 
 
 @router.post("/segments/clients")
-def segment_clients(
+async def segment_clients(
     req: ClientSegmentRequest, x_api_key: Optional[str] = Header(default=None)
 ):
     require_api_key(x_api_key)
@@ -73,7 +74,12 @@ def segment_clients(
     """
     params.append(float(req.min_monthly_revenue))  # type: ignore
 
-    rows = run_query(sql, params)
+    # sql + params já normalizados (janela rolling resolvida em datas)
+    rows = await run_admitted(
+        "segments/clients",
+        {"sql": sql, "params": params},
+        lambda: run_query(sql, params),
+    )
     return {
         "time_resolved": {"start": start, "end": end},
         "min_monthly_revenue": req.min_monthly_revenue,